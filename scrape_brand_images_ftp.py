@@ -1,14 +1,20 @@
 import csv
+import hashlib
 import os
 import time
 import re
 import json
-from io import BytesIO
+from io import BytesIO, StringIO
 from urllib.parse import urljoin, urlparse, quote_plus
-from ftplib import FTP
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+from ftplib import FTP, all_errors, error_perm
 
-import requests
-from bs4 import BeautifulSoup
+# requests / bs4 / aiohttp / asyncio sono importati solo quando serve
+# davvero fare scraping: i run senza CSV nuovo escono prima di caricarli.
+
+_MODULE_T0 = time.time()  # fallback se l'avvio del processo non è leggibile
 
 # ========================
 # CONFIGURAZIONE GENERALE
@@ -19,6 +25,13 @@ LOCAL_CSV_PATH = os.path.join(LOCAL_WORK_DIR, "prodotti.csv")
 REQUEST_TIMEOUT = 20
 SLEEP_BETWEEN_REQUESTS = 3  # secondi di pausa tra prodotti
 
+# Motore di scraping: "sync" (requests, un prodotto alla volta) oppure
+# "async" (asyncio + aiohttp, molte richieste in parallelo su domini diversi)
+SCRAPER_ENGINE = os.getenv("SCRAPER_ENGINE", "sync").strip().lower()
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "200"))
+ASYNC_PER_HOST_LIMIT = int(os.getenv("ASYNC_PER_HOST_LIMIT", "4"))
+ASYNC_PARSE_WORKERS = int(os.getenv("ASYNC_PARSE_WORKERS", "2"))
+
 # ========================
 # CONFIGURAZIONE FTP (da ENV)
 # ========================
@@ -34,6 +47,31 @@ FTP_CSV_DIR = os.getenv("FTP_CSV_DIR", "citymoda.cloud/public_html/input")
 FTP_CSV_FILENAME = os.getenv("FTP_CSV_FILENAME", "prodotti.csv")
 FTP_IMG_BASE_DIR = os.getenv("FTP_IMG_BASE_DIR", "citymoda.cloud/public_html/images")
 
+# suffisso dei file temporanei durante l'upload (poi rinominati nel nome finale)
+FTP_TMP_SUFFIX = ".part"
+# manifest per brand: /images/<brand_slug>/<FTP_MANIFEST_FILENAME>
+FTP_MANIFEST_FILENAME = os.getenv("FTP_MANIFEST_FILENAME", "manifest.json")
+
+# stato persistente tra i run (cache esiti negativi + statistiche brand)
+# e report delle righe saltate. Di default FUORI da public_html: sono file
+# interni e non devono essere scaricabili dal web.
+FTP_STATE_DIR = os.getenv("FTP_STATE_DIR", "/state")
+FTP_STATE_FILENAME = os.getenv("FTP_STATE_FILENAME", "scrape_state.json")
+FTP_SKIP_REPORT_FILENAME = os.getenv("FTP_SKIP_REPORT_FILENAME", "skipped_rows.csv")
+# MDTM/SIZE del CSV all'ultimo run completato: se non cambiano si esce subito
+FTP_INPUT_STAMP_FILENAME = os.getenv("FTP_INPUT_STAMP_FILENAME", "last_input.json")
+FORCE_RUN = os.getenv("FORCE_RUN", "").strip().lower() in ("1", "true", "yes")
+
+# dopo quanti giorni una coppia (brand, sku) senza risultati viene ritentata
+NEGATIVE_CACHE_TTL_DAYS = float(os.getenv("NEGATIVE_CACHE_TTL_DAYS", "14"))
+# le righe scartate per confidenza bassa dipendono dalla soglia del ranking,
+# non dal sito: cache separata e più breve, e non contano per lo skip brand
+LOW_CONFIDENCE_TTL_DAYS = float(os.getenv("LOW_CONFIDENCE_TTL_DAYS", "2"))
+# un brand con 0 risultati su almeno BRAND_SKIP_MIN_ATTEMPTS tentativi
+# viene saltato per BRAND_SKIP_TTL_DAYS giorni
+BRAND_SKIP_MIN_ATTEMPTS = int(os.getenv("BRAND_SKIP_MIN_ATTEMPTS", "20"))
+BRAND_SKIP_TTL_DAYS = float(os.getenv("BRAND_SKIP_TTL_DAYS", "7"))
+
 HEADERS = {
     "User-Agent": (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -65,6 +103,9 @@ BAD_IMAGE_KEYWORDS = [
 # soglia minima di area per considerare una img come foto prodotto (~200x200)
 MIN_IMAGE_AREA = 40000
 
+# confidenza minima (0..1) del ranking per scaricare la pagina prodotto
+MIN_MATCH_CONFIDENCE = float(os.getenv("MIN_MATCH_CONFIDENCE", "0.5"))
+
 # ===============================
 # MAPPATURA BRAND → DOMINIO UFFICIALE (fallback HTML)
 # ===============================
@@ -151,6 +192,14 @@ BRAND_DOMAIN_MAP = {
 _ftp = None
 ROOT_DIR = None  # root FTP dell'utente dopo il login
 
+# manifest del run corrente: brand_slug → {"brand": ..., "products": {sku: {filename: ...}}}
+_manifests = {}
+RUN_STARTED_AT = None
+
+# stato persistente: {"negative": {...}, "low_confidence": {...}, "brands": {...}}
+# (vedi load_scrape_state)
+_scrape_state = None
+
 
 # ========================
 # UTILITY DI BASE
@@ -174,6 +223,8 @@ def brand_to_folder(brand):
 
 
 def http_get(url):
+    import requests
+
     try:
         resp = requests.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
         if not resp.ok:
@@ -221,6 +272,14 @@ def get_ftp():
     return _ftp
 
 
+def ftp_close():
+    global _ftp
+    if _ftp is not None:
+        _ftp.quit()
+        _ftp = None
+        print("[*] Connessione FTP chiusa.")
+
+
 def ftp_download_csv(local_path):
     ftp = get_ftp()
 
@@ -238,6 +297,92 @@ def ftp_download_csv(local_path):
     ftp.cwd(ROOT_DIR)
 
 
+def ftp_csv_fingerprint():
+    """
+    MDTM + SIZE del CSV su FTP, senza scaricarlo.
+    Ritorna None se il server non supporta i comandi.
+    """
+    ftp = get_ftp()
+
+    try:
+        ftp.cwd(ROOT_DIR)
+        csv_dir = FTP_CSV_DIR.lstrip("/")
+        if csv_dir:
+            ftp.cwd(csv_dir)
+        mdtm = ftp.sendcmd("MDTM " + FTP_CSV_FILENAME).split()[-1]
+        ftp.voidcmd("TYPE I")
+        size = ftp.size(FTP_CSV_FILENAME)
+        ftp.cwd(ROOT_DIR)
+    except all_errors as e:
+        # è solo un'ottimizzazione: in caso di errore si fa il run completo
+        print("⚠️ MDTM/SIZE non disponibili per il CSV:", e)
+        return None
+
+    return {"filename": FTP_CSV_FILENAME, "mdtm": mdtm, "size": size}
+
+
+def input_unchanged(fingerprint):
+    if fingerprint is None:
+        return False
+
+    try:
+        content = ftp_download_bytes(FTP_STATE_DIR, FTP_INPUT_STAMP_FILENAME)
+    except all_errors as e:
+        print("⚠️ Impossibile leggere l'ultimo input elaborato:", e)
+        return False
+    if content is None:
+        return False
+
+    try:
+        last = json.loads(content.decode("utf-8"))
+    except Exception:
+        return False
+
+    if {k: last.get(k) for k in fingerprint} != fingerprint:
+        return False
+
+    # CSV invariato, ma se nel frattempo è scaduta una voce della cache
+    # negativa o uno skip brand quelle righe vanno ritentate
+    retry_at = last.get("retry_at")
+    if retry_at and time.time() >= retry_at:
+        print("[*] CSV invariato ma cache / skip brand scaduti: run completo.")
+        return False
+
+    return True
+
+
+def save_input_fingerprint(fingerprint, retry_at=None):
+    """
+    Salva MDTM/SIZE del CSV elaborato e, se c'è, la prima scadenza di
+    cache negativa / skip brand (retry_at, epoch).
+    """
+    if fingerprint is None:
+        return
+    content = json.dumps(dict(fingerprint, retry_at=retry_at)).encode("utf-8")
+    ftp_upload_atomic(content, FTP_STATE_DIR, FTP_INPUT_STAMP_FILENAME)
+
+
+def ftp_download_bytes(remote_dir, filename):
+    """
+    Scarica un file da FTP in memoria. Ritorna None se il file non esiste.
+    """
+    ftp = get_ftp()
+
+    ftp.cwd(ROOT_DIR)
+    bio = BytesIO()
+    try:
+        rel_dir = remote_dir.lstrip("/")
+        if rel_dir:
+            ftp.cwd(rel_dir)
+        ftp.retrbinary("RETR " + filename, bio.write)
+    except error_perm:
+        return None
+    finally:
+        ftp.cwd(ROOT_DIR)
+
+    return bio.getvalue()
+
+
 def ftp_ensure_dir(path):
     """
     Crea ricorsivamente la directory su FTP se non esiste.
@@ -257,15 +402,72 @@ def ftp_ensure_dir(path):
             ftp.cwd(p)
 
 
-def ftp_upload_image_stream(binary_content, remote_dir, filename):
+def ftp_upload_atomic(binary_content, remote_dir, filename):
+    """
+    Carica il file con un nome temporaneo e poi lo rinomina (RNFR/RNTO)
+    nel nome finale: chi legge la cartella (es. import Shopify) non vede
+    mai file caricati a metà.
+    """
     ftp = get_ftp()
 
     ftp_ensure_dir(remote_dir)
 
-    print(f"   ⬆ Upload diretto FTP in dir '{remote_dir}': {filename}")
+    tmp_name = f".{filename}{FTP_TMP_SUFFIX}"
     bio = BytesIO(binary_content)
-    ftp.storbinary("STOR " + filename, bio)
-    bio.close()
+    try:
+        ftp.storbinary("STOR " + tmp_name, bio)
+    finally:
+        bio.close()
+
+    try:
+        ftp.rename(tmp_name, filename)
+    except error_perm:
+        # alcuni server non sovrascrivono con RNTO. Solo se il file finale
+        # esiste davvero lo sposto da parte, riprovo e lo ripristino se il
+        # secondo rename fallisce: il file online non va mai perso.
+        if not ftp_file_exists(filename):
+            ftp_delete_quietly(tmp_name)
+            raise
+
+        old_name = f".{filename}.old"
+        try:
+            ftp.rename(filename, old_name)
+        except all_errors:
+            ftp_delete_quietly(tmp_name)
+            raise
+
+        try:
+            ftp.rename(tmp_name, filename)
+        except all_errors:
+            ftp.rename(old_name, filename)
+            ftp_delete_quietly(tmp_name)
+            raise
+
+        ftp_delete_quietly(old_name)
+
+
+def ftp_file_exists(filename):
+    """
+    True se filename esiste nella directory FTP corrente.
+    """
+    ftp = get_ftp()
+    try:
+        ftp.voidcmd("TYPE I")
+        return ftp.size(filename) is not None
+    except error_perm:
+        return False
+
+
+def ftp_delete_quietly(filename):
+    try:
+        get_ftp().delete(filename)
+    except all_errors:
+        pass
+
+
+def ftp_upload_image_stream(binary_content, remote_dir, filename):
+    print(f"   ⬆ Upload FTP in dir '{remote_dir}': {filename}")
+    ftp_upload_atomic(binary_content, remote_dir, filename)
 
 
 # ========================
@@ -340,125 +542,95 @@ def normalize_code_for_match(s):
     return re.sub(r"[^a-z0-9]", "", s.lower())
 
 
-def find_kocca_product_url(sku):
-    query = build_kocca_query_from_sku(sku)
+def build_kocca_suggest_url(query):
     q = quote_plus(query)
-
-    suggest_url = (
+    return (
         "https://kocca.it/search/suggest.json"
         f"?q={q}&resources[type]=product&resources[limit]=10"
     )
-    print(f"   🔍 (KOCCA JSON) {suggest_url}")
-    resp = http_get(suggest_url)
-    if not resp:
-        return None
 
-    try:
-        data = resp.json()
-    except Exception as e:
-        print("   ✖ Errore parsing JSON Kocca:", e)
-        return None
 
+def build_marc_ellis_suggest_url(query):
+    q = quote_plus(query)
+    return (
+        "https://marcellis.com/search/suggest.json"
+        f"?q={q}&resources[type]=product&resources[limit]=10"
+    )
+
+
+def products_from_suggest_json(data):
+    """
+    Estrae la lista prodotti dalla risposta di /search/suggest.json (Shopify).
+    """
     resources = data.get("resources") or {}
     results = resources.get("results") or {}
-    products = results.get("products") or []
+    return results.get("products") or []
 
-    if not products:
-        print("   ✖ Nessun prodotto KOCCA da suggest.json")
-        return None
 
-    query_l = query.lower()
-    best = None
-    best_score = -1
+def pick_product_url_from_suggest(data, base_url, sku, query, label):
+    """
+    Ritorna (url, confidenza) del miglior prodotto di suggest.json, oppure
+    (None, 0.0) se non ci sono candidati. La soglia la applica il chiamante.
+    """
+    candidates = candidates_from_suggest_json(data, base_url)
+    if not candidates:
+        print(f"   ✖ Nessun prodotto {label} da suggest.json")
+        return None, 0.0
 
-    for p in products:
-        title = (p.get("title") or "").lower()
-        handle = (p.get("handle") or "").lower()
-        p_url = p.get("url") or ""
+    url, confidence = pick_best_candidate(candidates, sku, query)
+    print(f"   🎯 Miglior candidato {label} (confidenza {confidence:.2f})")
+    return url, confidence
 
-        score = 0
-        if query_l in title:
-            score += 3
-        if query_l in handle:
-            score += 2
-        if "clementina" in query_l and "clementina" in title:
-            score += 1
 
-        if score > best_score:
-            best_score = score
-            best = p_url or ("/products/" + handle if handle else None)
+def find_kocca_product_url(sku):
+    query = build_kocca_query_from_sku(sku)
+    suggest_url = build_kocca_suggest_url(query)
 
-    if not best:
-        return None
+    print(f"   🔍 (KOCCA JSON) {suggest_url}")
+    resp = http_get(suggest_url)
+    if not resp:
+        return None, 0.0
 
-    return urljoin("https://kocca.it", best)
+    try:
+        data = resp.json()
+    except Exception as e:
+        print("   ✖ Errore parsing JSON Kocca:", e)
+        return None, 0.0
+
+    return pick_product_url_from_suggest(data, "https://kocca.it", sku, query, "KOCCA")
 
 
 def find_marc_ellis_product_url(sku):
     query = build_marc_ellis_query_from_sku(sku)
-    q = quote_plus(query)
+    suggest_url = build_marc_ellis_suggest_url(query)
 
-    suggest_url = (
-        "https://marcellis.com/search/suggest.json"
-        f"?q={q}&resources[type]=product&resources[limit]=10"
-    )
     print(f"   🔍 (MARC ELLIS JSON) {suggest_url}")
     resp = http_get(suggest_url)
     if not resp:
-        return None
+        return None, 0.0
 
     try:
         data = resp.json()
     except Exception as e:
         print("   ✖ Errore parsing JSON Marc Ellis:", e)
-        return None
-
-    resources = data.get("resources") or {}
-    results = resources.get("results") or {}
-    products = results.get("products") or []
-
-    if not products:
-        print("   ✖ Nessun prodotto Marc Ellis da suggest.json")
-        return None
-
-    sku_norm = normalize_code_for_match(sku)
-    tokens = [t for t in re.split(r"\s+", query.lower()) if len(t) > 2]
+        return None, 0.0
 
-    best = None
-    best_score = -1
-
-    for p in products:
-        title = (p.get("title") or "").lower()
-        handle = (p.get("handle") or "").lower()
-        p_url = p.get("url") or ""
-
-        handle_norm = normalize_code_for_match(handle)
-        title_norm = normalize_code_for_match(title)
-
-        score = 0
-
-        if sku_norm and sku_norm in handle_norm:
-            score += 100
-        elif sku_norm and handle_norm in sku_norm:
-            score += 80
-
-        if sku_norm and sku_norm in title_norm:
-            score += 40
-
-        for t in tokens:
-            if t in title:
-                score += 2
-            if t in handle:
-                score += 1
+    return pick_product_url_from_suggest(
+        data, "https://marcellis.com", sku, query, "MARC ELLIS"
+    )
 
-        if score > best_score:
-            best_score = score
-            best = p_url or ("/products/" + handle if handle else None)
 
-    if not best:
-        return None
+def build_search_query(brand, sku):
+    """
+    Query usata nella ricerca HTML del brand (serve anche al ranking).
+    """
+    b = (brand or "").strip().lower()
 
-    return urljoin("https://marcellis.com", best)
+    if b == "peuterey":
+        return build_peuterey_query_from_sku(sku)
+    if b == "blauer":
+        return build_blauer_query_from_sku(sku)
+    return sku.strip()
 
 
 def build_search_url(brand, sku):
@@ -469,15 +641,12 @@ def build_search_url(brand, sku):
     - altri brand: /search?q=SKU
     """
     b = (brand or "").strip().lower()
+    q = quote_plus(build_search_query(brand, sku))
 
     if b == "peuterey":
-        query = build_peuterey_query_from_sku(sku)
-        q = quote_plus(query)
         return f"https://www.peuterey.com/it/search/?q={q}"
 
     if b == "blauer":
-        query = build_blauer_query_from_sku(sku)
-        q = quote_plus(query)
         return (
             "https://www.blauerusa.com/eshop/search/"
             "?search_type=&search_id=&product_id=&product_name=" + q
@@ -487,27 +656,9 @@ def build_search_url(brand, sku):
     if not domain:
         return None
 
-    q = quote_plus(sku.strip())
     return f"https://{domain}/search?q={q}"
 
 
-def pick_first_product_link_from_search(html, base_url):
-    soup = BeautifulSoup(html, "html.parser")
-
-    for a in soup.find_all("a", href=True):
-        if a.find("img"):
-            return urljoin(base_url, a["href"])
-
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        full = urljoin(base_url, href)
-        path = urlparse(full).path.lower()
-        if any(x in path for x in ["/product", "/prod", "/p/", "/item", "/art"]):
-            return full
-
-    return None
-
-
 def extract_all_images_from_product_page(html, page_url):
     """
     Estrae TUTTE le immagini prodotto:
@@ -519,6 +670,8 @@ def extract_all_images_from_product_page(html, page_url):
     - immagini con keyword di layout (logo, banner, hero, ecc.)
     - immagini troppo piccole se non sembrano prodotto
     """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html, "html.parser")
     urls = []
 
@@ -614,23 +767,522 @@ def extract_all_images_from_product_page(html, page_url):
     return urls
 
 
+# ========================
+# RANKING CANDIDATI (SEARCH HTML / SUGGEST.JSON)
+# ========================
+# Ogni candidato è {"url": ..., "texts": [...], "has_img": bool}.
+# Il punteggio (0..1) confronta ogni testo del candidato (titolo, handle,
+# alt immagine, slug URL) con lo SKU normalizzato e con la query del brand:
+# - contenimento del codice SKU (o della query) → confidenza alta
+# - sottostringa comune più lunga con lo SKU
+# - copertura dei trigrammi e dei token della query
+
+PRODUCT_PATH_HINTS = ["/product", "/prod", "/p/", "/item", "/art"]
+NON_PRODUCT_PATH_HINTS = [
+    "/search", "/cart", "/account", "/login", "/pages/", "/blogs/",
+    "/policies/", "/wishlist", "/store-locator", "/customer",
+]
+
+
+def char_ngrams(s, n=3):
+    if len(s) < n:
+        return {s} if s else set()
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+
+def text_tokens(s):
+    return re.findall(r"[a-z0-9]+", (s or "").lower())
+
+
+def longest_common_ratio(code, text):
+    """
+    Lunghezza della sottostringa comune più lunga tra code e text,
+    rispetto alla lunghezza di code (0 se sotto i 4 caratteri).
+    """
+    if not code or not text:
+        return 0.0
+    match = SequenceMatcher(None, code, text, autojunk=False).find_longest_match(
+        0, len(code), 0, len(text)
+    )
+    if match.size < 4:
+        return 0.0
+    return match.size / len(code)
+
+
+def score_text_against_sku(text, sku_norm, query_norm, query_tokens):
+    text_norm = normalize_code_for_match(text)
+    if not text_norm:
+        return 0.0
+
+    if sku_norm and sku_norm in text_norm:
+        return 1.0
+
+    # 1) contenimento del codice: ogni ramo cresce con la parte di SKU
+    # coperta, così chi copre più SKU non può avere punteggio più basso.
+    # Un frammento dello SKU conta solo se copre la query del brand o
+    # almeno metà SKU (es. codici colore/taglia condivisi tra prodotti).
+    lcs = longest_common_ratio(sku_norm, text_norm)
+    code = 0.6 * lcs
+    if len(text_norm) >= 6 and text_norm in sku_norm:
+        coverage = len(text_norm) / len(sku_norm)
+        covers_query = bool(query_norm) and query_norm in text_norm
+        if covers_query or coverage >= 0.5:
+            code = max(code, 0.6 + 0.4 * coverage)
+    if query_norm and len(query_norm) >= 4 and query_norm in text_norm:
+        code = max(code, 0.8 + 0.15 * lcs)
+
+    # 2) similarità fuzzy (trigrammi + token) rispetto alla query
+    fuzzy = 0.0
+    q_grams = char_ngrams(query_norm or sku_norm)
+    if q_grams:
+        fuzzy = len(q_grams & char_ngrams(text_norm)) / len(q_grams)
+
+    tokens = 0.0
+    if query_tokens:
+        t_tokens = set(text_tokens(text))
+        tokens = sum(1 for t in query_tokens if t in t_tokens) / len(query_tokens)
+
+    return max(code, 0.5 * fuzzy + 0.3 * tokens)
+
+
+def score_candidate(candidate, sku, query=None):
+    sku_norm = normalize_code_for_match(sku)
+    query_norm = normalize_code_for_match(query or "")
+    query_tokens = [t for t in text_tokens(query or sku) if len(t) > 2]
+
+    score = 0.0
+    for text in candidate["texts"]:
+        score = max(score, score_text_against_sku(text, sku_norm, query_norm, query_tokens))
+
+    path = urlparse(candidate["url"]).path.lower()
+    if not candidate.get("has_img") and not any(x in path for x in PRODUCT_PATH_HINTS):
+        score *= 0.85
+
+    return round(score, 3)
+
+
+def rank_candidates(candidates, sku, query=None):
+    """
+    Ritorna [(score, candidato), ...] ordinati dal migliore; a parità di
+    punteggio vince l'ordine originale della pagina.
+    """
+    scored = [(score_candidate(c, sku, query), i, c) for i, c in enumerate(candidates)]
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return [(score, c) for score, _, c in scored]
+
+
+def pick_best_candidate(candidates, sku, query=None):
+    """
+    Ritorna (url, confidenza) del candidato migliore, oppure (None, 0.0).
+    """
+    ranked = rank_candidates(candidates, sku, query)
+    if not ranked:
+        return None, 0.0
+    score, best = ranked[0]
+    return best["url"], score
+
+
+def candidates_from_suggest_json(data, base_url):
+    candidates = []
+    for p in products_from_suggest_json(data):
+        handle = p.get("handle") or ""
+        p_url = p.get("url") or ("/products/" + handle if handle else None)
+        if not p_url:
+            continue
+        candidates.append({
+            "url": urljoin(base_url, p_url),
+            "texts": [t for t in (p.get("title"), handle) if t],
+            "has_img": bool(p.get("image") or p.get("featured_image")),
+        })
+    return candidates
+
+
+# attributi data-* in cui gli shop mettono spesso il codice articolo
+CODE_ATTRIBUTE_HINTS = ["sku", "product-id", "productid", "article", "code", "style", "item-id"]
+
+
+def image_file_stem(img):
+    """
+    Nome file (senza estensione) dell'immagine: spesso contiene il codice
+    articolo, es. .../GX1234_01_standard.jpg → 'GX1234_01_standard'.
+    """
+    src = img.get("src") or img.get("data-src") or img.get("data-srcset") or ""
+    src = src.split(",")[0].split(" ")[0]
+    name = urlparse(src).path.rstrip("/").rsplit("/", 1)[-1]
+    return os.path.splitext(name)[0] or None
+
+
+def code_attributes(tag, levels=3):
+    """
+    Valori degli attributi data-* "da codice" del tag e dei suoi
+    contenitori più vicini (la card prodotto).
+    """
+    values = []
+    node = tag
+    for _ in range(levels + 1):
+        if node is None or not hasattr(node, "attrs"):
+            break
+        for name, value in node.attrs.items():
+            if not name.startswith("data-") or not any(h in name for h in CODE_ATTRIBUTE_HINTS):
+                continue
+            if isinstance(value, list):
+                value = " ".join(value)
+            if value and value not in values:
+                values.append(value)
+        node = node.parent
+    return values
+
+
+def host_without_www(url):
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def extract_search_candidates(html, base_url):
+    """
+    Tutti i link della pagina di ricerca che possono essere un prodotto
+    (stesso dominio, niente carrello / account / ricerca), uniti per URL.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    base_host = host_without_www(base_url)
+
+    by_url = {}
+    for a in soup.find_all("a", href=True):
+        full = urljoin(base_url, a["href"]).split("#")[0]
+        parsed = urlparse(full)
+        if parsed.scheme not in ("http", "https"):
+            continue
+        if host_without_www(full) != base_host:
+            continue
+        path = parsed.path.lower()
+        if path in ("", "/") or any(x in path for x in NON_PRODUCT_PATH_HINTS):
+            continue
+
+        img = a.find("img")
+        texts = [
+            a.get_text(" ", strip=True),
+            a.get("title"),
+            img.get("alt") if img else None,
+            image_file_stem(img) if img else None,
+            path.rstrip("/").rsplit("/", 1)[-1],
+        ]
+        texts.extend(code_attributes(a))
+        if img:
+            texts.extend(code_attributes(img))
+
+        cand = by_url.setdefault(full, {"url": full, "texts": [], "has_img": False})
+        cand["has_img"] = cand["has_img"] or img is not None
+        for t in texts:
+            if t and t not in cand["texts"]:
+                cand["texts"].append(t)
+
+    return list(by_url.values())
+
+
+def pick_best_product_link_from_search(html, base_url, sku, query=None):
+    return pick_best_candidate(extract_search_candidates(html, base_url), sku, query)
+
+
+# ========================
+# CACHE ESITI NEGATIVI / SKIP BRAND
+# ========================
+# Lo stato è salvato su FTP (FTP_STATE_DIR/FTP_STATE_FILENAME):
+#   "negative":       "BRAND|SKU" → {"reason", "expires_at", "count"}
+#   "low_confidence": "BRAND|SKU" → {"reason", "expires_at", "count"}
+#   "brands":         "BRAND"     → {"attempts", "hits", "skip_until"}
+# Le coppie (brand, sku) note come irrisolvibili e i brand con hit rate
+# zero vengono saltati fino alla scadenza e scritti nel report.
+
+# esiti che provano che il sito non ha il prodotto: cache lunga e contano
+# come tentativi a vuoto del brand (gli errori di rete no)
+NEGATIVE_OUTCOMES = {"no_product", "no_image"}
+
+
+def negative_cache_key(sku, brand):
+    return f"{(brand or '').strip().upper()}|{sku.strip().upper()}"
+
+
+def load_scrape_state():
+    global _scrape_state
+
+    _scrape_state = {"negative": {}, "low_confidence": {}, "brands": {}}
+
+    content = ftp_download_bytes(FTP_STATE_DIR, FTP_STATE_FILENAME)
+    if content is None:
+        print("[*] Nessuno stato precedente su FTP: parto da zero.")
+        return _scrape_state
+
+    try:
+        data = json.loads(content.decode("utf-8"))
+    except Exception as e:
+        print("⚠️ Stato su FTP non leggibile, lo ignoro:", e)
+        return _scrape_state
+
+    now = time.time()
+    for cache in ("negative", "low_confidence"):
+        _scrape_state[cache] = {
+            k: v for k, v in (data.get(cache) or {}).items()
+            if v.get("expires_at", 0) > now
+        }
+    _scrape_state["brands"] = data.get("brands") or {}
+    print(
+        f"[*] Stato caricato: {len(_scrape_state['negative'])} SKU in cache negativa, "
+        f"{len(_scrape_state['low_confidence'])} a confidenza bassa, "
+        f"{len(_scrape_state['brands'])} brand con statistiche."
+    )
+    return _scrape_state
+
+
+def save_scrape_state():
+    if _scrape_state is None:
+        return
+    content = json.dumps(_scrape_state, ensure_ascii=False, indent=2).encode("utf-8")
+    print(f"[*] Salvo stato su FTP: {FTP_STATE_DIR}/{FTP_STATE_FILENAME}")
+    ftp_upload_atomic(content, FTP_STATE_DIR, FTP_STATE_FILENAME)
+
+
+def brand_stats(brand):
+    key = (brand or "").strip().upper()
+    return _scrape_state["brands"].setdefault(
+        key, {"attempts": 0, "hits": 0, "skip_until": 0}
+    )
+
+
+def brand_hit_rate(brand):
+    stats = brand_stats(brand)
+    if not stats["attempts"]:
+        return None
+    return stats["hits"] / stats["attempts"]
+
+
+def skip_reason(sku, brand, now):
+    """
+    Ritorna (motivo, scadenza) se la riga va saltata, altrimenti None.
+    """
+    stats = brand_stats(brand)
+    if stats["skip_until"] > now:
+        return "brand_zero_hit_rate", stats["skip_until"]
+    if stats["skip_until"]:
+        # skip del brand scaduto: si riparte con statistiche pulite
+        stats.update(attempts=0, hits=0, skip_until=0)
+
+    key = negative_cache_key(sku, brand)
+    for cache in ("negative", "low_confidence"):
+        entry = _scrape_state[cache].get(key)
+        if entry:
+            return entry["reason"], entry["expires_at"]
+
+    return None
+
+
+def plan_rows(rows):
+    """
+    Divide le righe in (da processare, saltate). Quelle da processare sono
+    ordinate per hit rate del brand decrescente (brand nuovi in testa),
+    così i brand poco produttivi finiscono in coda al run.
+    """
+    now = time.time()
+    todo = []
+    skipped = []
+
+    for sku, brand in rows:
+        reason = skip_reason(sku, brand, now)
+        if reason:
+            skipped.append((sku, brand) + reason)
+        else:
+            todo.append((sku, brand))
+
+    def priority(row):
+        rate = brand_hit_rate(row[1])
+        return -(1.0 if rate is None else rate)
+
+    todo.sort(key=priority)
+    return todo, skipped
+
+
+def cache_negative_outcome(cache, key, outcome, expires_at):
+    entry = _scrape_state[cache].get(key) or {"count": 0}
+    entry.update(reason=outcome, expires_at=int(expires_at), count=entry["count"] + 1)
+    _scrape_state[cache][key] = entry
+
+
+def next_state_expiry():
+    """
+    Prima scadenza (epoch) tra cache negative e skip brand, oppure None.
+    """
+    if _scrape_state is None:
+        return None
+
+    expiries = [
+        entry["expires_at"]
+        for cache in ("negative", "low_confidence")
+        for entry in _scrape_state[cache].values()
+    ]
+    expiries.extend(
+        stats["skip_until"] for stats in _scrape_state["brands"].values()
+        if stats["skip_until"]
+    )
+    return min(expiries) if expiries else None
+
+
+def record_outcome(sku, brand, outcome):
+    if _scrape_state is None or outcome in ("no_search_url", "request_failed"):
+        return
+
+    now = time.time()
+    key = negative_cache_key(sku, brand)
+
+    if outcome == "low_confidence":
+        cache_negative_outcome("low_confidence", key, outcome, now + LOW_CONFIDENCE_TTL_DAYS * 86400)
+        return
+
+    stats = brand_stats(brand)
+    stats["attempts"] += 1
+
+    if outcome == "ok":
+        stats["hits"] += 1
+        _scrape_state["negative"].pop(key, None)
+        _scrape_state["low_confidence"].pop(key, None)
+    elif outcome in NEGATIVE_OUTCOMES:
+        cache_negative_outcome("negative", key, outcome, now + NEGATIVE_CACHE_TTL_DAYS * 86400)
+
+    if stats["attempts"] >= BRAND_SKIP_MIN_ATTEMPTS and stats["hits"] == 0:
+        if not stats["skip_until"]:
+            print(f"⚠️ Brand {brand}: 0 risultati su {stats['attempts']} tentativi, lo salto per {BRAND_SKIP_TTL_DAYS:g} giorni.")
+        stats["skip_until"] = int(now + BRAND_SKIP_TTL_DAYS * 86400)
+
+
+def ftp_upload_skip_report(skipped):
+    """
+    Carica il CSV delle righe saltate (sku, brand, motivo, data di retry).
+    """
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["sku", "brand", "reason", "retry_after"])
+    for sku, brand, reason, until in skipped:
+        retry_after = datetime.fromtimestamp(until, timezone.utc).isoformat(timespec="seconds")
+        writer.writerow([sku, brand, reason, retry_after])
+
+    print(f"[*] Report righe saltate ({len(skipped)}) → {FTP_STATE_DIR}/{FTP_SKIP_REPORT_FILENAME}")
+    ftp_upload_atomic(out.getvalue().encode("utf-8"), FTP_STATE_DIR, FTP_SKIP_REPORT_FILENAME)
+
+
+# ========================
+# MANIFEST PER BRAND
+# ========================
+
+def manifest_add_image(brand, sku, filename, binary_content, source_url):
+    """
+    Registra un'immagine caricata nel manifest del brand per questo run.
+    """
+    brand_slug = brand_to_folder(brand)
+    manifest = _manifests.setdefault(
+        brand_slug, {"brand": brand, "brand_slug": brand_slug, "products": {}}
+    )
+    # per filename: se lo SKU compare più volte nel CSV l'entry viene
+    # sostituita, non duplicata
+    manifest["products"].setdefault(sku, {})[filename] = {
+        "filename": filename,
+        "size": len(binary_content),
+        "sha256": hashlib.sha256(binary_content).hexdigest(),
+        "source_url": source_url,
+    }
+
+
+def ftp_load_previous_manifest(remote_dir):
+    """
+    Prodotti del manifest già presente su FTP, come sku → {filename: entry}.
+    Ritorna None se non è leggibile (in quel caso non va sovrascritto).
+    """
+    try:
+        content = ftp_download_bytes(remote_dir, FTP_MANIFEST_FILENAME)
+    except all_errors as e:
+        print(f"⚠️ Manifest precedente in '{remote_dir}' non scaricabile:", e)
+        return None
+    if content is None:
+        return {}
+
+    try:
+        products = json.loads(content.decode("utf-8")).get("products") or {}
+        return {
+            sku: {e["filename"]: e for e in entries}
+            for sku, entries in products.items()
+        }
+    except Exception as e:
+        print(f"⚠️ Manifest precedente in '{remote_dir}' non leggibile:", e)
+        return None
+
+
+def ftp_publish_manifests():
+    """
+    Aggiorna il manifest JSON di ogni brand toccato dal run: le immagini di
+    questo run vengono unite al manifest precedente (per SKU e filename) e
+    il risultato è caricato in un solo upload atomico. Il manifest descrive
+    quindi tutta la cartella, anche gli SKU non rielaborati in questo run,
+    e chi consuma le immagini può confrontarlo invece di fare LIST.
+    """
+    for brand_slug, manifest in sorted(_manifests.items()):
+        remote_dir = brand_remote_dir(manifest["brand"])
+
+        products = ftp_load_previous_manifest(remote_dir)
+        if products is None:
+            print(f"⚠️ Manifest '{brand_slug}' non aggiornato per non perdere le voci precedenti.")
+            continue
+
+        for sku, entries in manifest["products"].items():
+            products.setdefault(sku, {}).update(entries)
+
+        payload = {
+            "brand": manifest["brand"],
+            "brand_slug": brand_slug,
+            "products": {
+                sku: [entries[name] for name in sorted(entries)]
+                for sku, entries in sorted(products.items())
+            },
+            "generated_at": RUN_STARTED_AT,
+        }
+        content = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+
+        n_images = sum(len(v) for v in manifest["products"].values())
+        print(
+            f"[*] Manifest '{brand_slug}': {len(manifest['products'])} SKU aggiornati "
+            f"({n_images} immagini), {len(products)} SKU totali → "
+            f"{remote_dir}/{FTP_MANIFEST_FILENAME}"
+        )
+        ftp_upload_atomic(content, remote_dir, FTP_MANIFEST_FILENAME)
+
+
 # ========================
 # DOWNLOAD & UPLOAD IMMAGINI
 # ========================
 
+def build_image_filename(sku, img_index, ext):
+    if img_index == 1:
+        return f"{sku}{ext}"
+    return f"{sku}_{img_index}{ext}"
+
+
+def brand_remote_dir(brand):
+    brand_folder = brand_to_folder(brand)
+    return os.path.join(FTP_IMG_BASE_DIR, brand_folder).replace("\\", "/")
+
+
 def download_and_upload_images(img_urls, sku, brand):
     """
     Scarica e carica su FTP tutte le immagini nella lista.
     Prima immagine: SKU.ext
     Successive: SKU_2.ext, SKU_3.ext, ...
+    Ritorna il numero di immagini caricate.
     """
     if not img_urls:
         print("   ✖ Nessuna immagine da scaricare.")
-        return
+        return 0
 
-    brand_folder = brand_to_folder(brand)
-    remote_dir = os.path.join(FTP_IMG_BASE_DIR, brand_folder).replace("\\", "/")
+    remote_dir = brand_remote_dir(brand)
 
+    uploaded = 0
     img_index = 0
     for img_url in img_urls:
         if is_bad_image_url(img_url):
@@ -648,12 +1300,12 @@ def download_and_upload_images(img_urls, sku, brand):
             print("   ⚠️ Ignorata immagine SVG (da estensione):", img_url)
             continue
 
-        if img_index == 1:
-            filename = f"{sku}{ext}"
-        else:
-            filename = f"{sku}_{img_index}{ext}"
-
+        filename = build_image_filename(sku, img_index, ext)
         ftp_upload_image_stream(resp.content, remote_dir, filename)
+        manifest_add_image(brand, sku, filename, resp.content, img_url)
+        uploaded += 1
+
+    return uploaded
 
 
 # ========================
@@ -661,65 +1313,342 @@ def download_and_upload_images(img_urls, sku, brand):
 # ========================
 
 def process_product(sku, brand):
+    """
+    Ritorna l'esito della riga (vedi NEGATIVE_OUTCOMES / record_outcome):
+    "ok", "no_search_url", "request_failed", "no_product",
+    "low_confidence", "no_image".
+    """
     print(f"\n➡️ SKU: {sku} | Brand: {brand}")
     b = (brand or "").strip().lower()
 
     product_url = None
 
     # 1) BRAND-SPECIFIC JSON SEARCH
-    if b == "kocca":
-        product_url = find_kocca_product_url(sku)
-        if product_url:
-            print(f"   🔗 Pagina prodotto KOCCA (JSON): {product_url}")
-    elif b == "marc ellis":
-        product_url = find_marc_ellis_product_url(sku)
+    # (fallback HTML solo se suggest.json fallisce o non ha candidati)
+    if b in ("kocca", "marc ellis"):
+        if b == "kocca":
+            product_url, confidence = find_kocca_product_url(sku)
+        else:
+            product_url, confidence = find_marc_ellis_product_url(sku)
+        if product_url and confidence < MIN_MATCH_CONFIDENCE:
+            print(f"   ✖ Nessun prodotto affidabile da suggest.json (confidenza {confidence:.2f})")
+            return "low_confidence"
         if product_url:
-            print(f"   🔗 Pagina prodotto MARC ELLIS (JSON): {product_url}")
+            print(f"   🔗 Pagina prodotto {brand.upper()} (JSON): {product_url}")
 
     # 2) FALLBACK HTML (incl. PEUTEREY, BLAUER)
     if not product_url:
         search_url = build_search_url(brand, sku)
         if not search_url:
             print("   ✖ Nessuna URL di ricerca disponibile per questo brand.")
-            return
+            return "no_search_url"
 
         print(f"   🔍 Cerco prodotto (fallback HTML) su: {search_url}")
         search_resp = http_get(search_url)
         if not search_resp:
-            return
+            return "request_failed"
 
-        product_url = pick_first_product_link_from_search(search_resp.text, search_url)
+        # base = URL finale dopo eventuali redirect (es. dominio senza www)
+        product_url, confidence = pick_best_product_link_from_search(
+            search_resp.text, search_resp.url, sku, build_search_query(brand, sku)
+        )
         if not product_url:
             print("   ✖ Nessuna pagina prodotto trovata nemmeno via HTML.")
-            return
+            return "no_product"
+        if confidence < MIN_MATCH_CONFIDENCE:
+            print(f"   ✖ Nessun candidato affidabile via HTML (confidenza {confidence:.2f}): {product_url}")
+            return "low_confidence"
 
-        print(f"   🔗 Pagina prodotto (fallback HTML): {product_url}")
+        print(f"   🔗 Pagina prodotto (fallback HTML, confidenza {confidence:.2f}): {product_url}")
 
     # 3) SCARICA PAGINA PRODOTTO E TROVA IMMAGINI
     time.sleep(SLEEP_BETWEEN_REQUESTS)
     product_resp = http_get(product_url)
     if not product_resp:
-        return
+        return "request_failed"
 
     img_urls = extract_all_images_from_product_page(product_resp.text, product_url)
     if not img_urls:
         print("   ✖ Nessuna immagine trovata nella pagina prodotto.")
-        return
+        return "no_image"
 
     print(f"   ✅ Trovate {len(img_urls)} immagini prodotto (dopo filtri).")
-    download_and_upload_images(img_urls, sku, brand)
+    if not download_and_upload_images(img_urls, sku, brand):
+        return "request_failed"
+    return "ok"
+
+
+# ========================
+# MOTORE ASYNC (asyncio + aiohttp)
+# ========================
+# Stessa logica di process_product (ricerca → pagina prodotto → immagini),
+# ma con centinaia di richieste in volo su domini diversi.
+# - semaforo per host: max ASYNC_PER_HOST_LIMIT richieste per dominio
+# - parsing BeautifulSoup (html.parser è puro Python e tiene il GIL) in un
+#   piccolo pool di processi, così non blocca l'event loop
+# - upload FTP serializzati (ftplib usa una sola connessione bloccante)
+
+class AsyncScraper:
+    def __init__(self, asyncio, session, loop, parse_executor):
+        # asyncio è passato dal chiamante (importato solo col motore async)
+        self.asyncio = asyncio
+        self.session = session
+        self.loop = loop
+        self.parse_executor = parse_executor
+        self.host_semaphores = {}
+        self.ftp_lock = asyncio.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc.lower()
+        sem = self.host_semaphores.get(host)
+        if sem is None:
+            sem = self.asyncio.Semaphore(ASYNC_PER_HOST_LIMIT)
+            self.host_semaphores[host] = sem
+        return sem
+
+    async def http_get(self, url, kind="text"):
+        """
+        Versione async di http_get: ritorna direttamente il contenuto
+        (kind = "text" | "json" | "bytes", oppure "page" → (testo, URL finale
+        dopo i redirect)) oppure None in caso di errore.
+        """
+        async with self._host_semaphore(url):
+            try:
+                async with self.session.get(url) as resp:
+                    if resp.status >= 400:
+                        print(f"   ✖ Richiesta fallita ({resp.status}) → {url}")
+                        return None
+                    if kind == "json":
+                        return await resp.json(content_type=None)
+                    if kind == "bytes":
+                        return await resp.read()
+                    if kind == "page":
+                        return await resp.text(errors="replace"), str(resp.url)
+                    return await resp.text(errors="replace")
+            except Exception as e:
+                print(f"   ✖ Errore richiesta {url}: {e!r}")
+                return None
+
+    async def parse(self, func, *args):
+        return await self.loop.run_in_executor(self.parse_executor, func, *args)
+
+    async def ftp_upload(self, binary_content, remote_dir, filename):
+        async with self.ftp_lock:
+            await self.loop.run_in_executor(
+                None, ftp_upload_image_stream, binary_content, remote_dir, filename
+            )
+
+    async def find_kocca_product_url(self, sku):
+        query = build_kocca_query_from_sku(sku)
+        suggest_url = build_kocca_suggest_url(query)
+
+        print(f"   🔍 [{sku}] (KOCCA JSON) {suggest_url}")
+        data = await self.http_get(suggest_url, kind="json")
+        if not isinstance(data, dict):
+            return None, 0.0
+
+        return pick_product_url_from_suggest(data, "https://kocca.it", sku, query, "KOCCA")
+
+    async def find_marc_ellis_product_url(self, sku):
+        query = build_marc_ellis_query_from_sku(sku)
+        suggest_url = build_marc_ellis_suggest_url(query)
+
+        print(f"   🔍 [{sku}] (MARC ELLIS JSON) {suggest_url}")
+        data = await self.http_get(suggest_url, kind="json")
+        if not isinstance(data, dict):
+            return None, 0.0
+
+        return pick_product_url_from_suggest(
+            data, "https://marcellis.com", sku, query, "MARC ELLIS"
+        )
+
+    async def download_and_upload_images(self, img_urls, sku, brand):
+        remote_dir = brand_remote_dir(brand)
+
+        # stessa numerazione del motore sync: l'indice avanza anche se il
+        # download fallisce, così i nomi file restano identici
+        indexed = []
+        for img_url in img_urls:
+            if is_bad_image_url(img_url):
+                print(f"   ⚠️ [{sku}] Ignorata immagine non valida / layout:", img_url)
+                continue
+            indexed.append((len(indexed) + 1, img_url))
+
+        contents = await self.asyncio.gather(
+            *(self.http_get(img_url, kind="bytes") for _, img_url in indexed)
+        )
+
+        uploaded = 0
+        for (img_index, img_url), content in zip(indexed, contents):
+            if not content:
+                continue
+
+            ext = get_file_extension_from_url(img_url)
+            if ext.lower() == ".svg":
+                print(f"   ⚠️ [{sku}] Ignorata immagine SVG (da estensione):", img_url)
+                continue
+
+            filename = build_image_filename(sku, img_index, ext)
+            await self.ftp_upload(content, remote_dir, filename)
+            manifest_add_image(brand, sku, filename, content, img_url)
+            uploaded += 1
+
+        return uploaded
+
+    async def process_product(self, sku, brand):
+        print(f"\n➡️ SKU: {sku} | Brand: {brand}")
+        b = (brand or "").strip().lower()
+
+        product_url = None
+
+        # 1) BRAND-SPECIFIC JSON SEARCH
+        # (fallback HTML solo se suggest.json fallisce o non ha candidati)
+        if b in ("kocca", "marc ellis"):
+            if b == "kocca":
+                product_url, confidence = await self.find_kocca_product_url(sku)
+            else:
+                product_url, confidence = await self.find_marc_ellis_product_url(sku)
+            if product_url and confidence < MIN_MATCH_CONFIDENCE:
+                print(f"   ✖ [{sku}] Nessun prodotto affidabile da suggest.json (confidenza {confidence:.2f})")
+                return "low_confidence"
+
+        # 2) FALLBACK HTML (incl. PEUTEREY, BLAUER)
+        if not product_url:
+            search_url = build_search_url(brand, sku)
+            if not search_url:
+                print(f"   ✖ [{sku}] Nessuna URL di ricerca disponibile per questo brand.")
+                return "no_search_url"
+
+            print(f"   🔍 [{sku}] Cerco prodotto (fallback HTML) su: {search_url}")
+            page = await self.http_get(search_url, kind="page")
+            if not page:
+                return "request_failed"
+            search_html, final_url = page
+
+            product_url, confidence = await self.parse(
+                pick_best_product_link_from_search,
+                search_html, final_url, sku, build_search_query(brand, sku),
+            )
+            if not product_url:
+                print(f"   ✖ [{sku}] Nessuna pagina prodotto trovata nemmeno via HTML.")
+                return "no_product"
+            if confidence < MIN_MATCH_CONFIDENCE:
+                print(f"   ✖ [{sku}] Nessun candidato affidabile via HTML (confidenza {confidence:.2f})")
+                return "low_confidence"
+
+        print(f"   🔗 [{sku}] Pagina prodotto: {product_url}")
+
+        # 3) SCARICA PAGINA PRODOTTO E TROVA IMMAGINI
+        await self.asyncio.sleep(SLEEP_BETWEEN_REQUESTS)
+        product_html = await self.http_get(product_url)
+        if not product_html:
+            return "request_failed"
+
+        img_urls = await self.parse(
+            extract_all_images_from_product_page, product_html, product_url
+        )
+        if not img_urls:
+            print(f"   ✖ [{sku}] Nessuna immagine trovata nella pagina prodotto.")
+            return "no_image"
+
+        print(f"   ✅ [{sku}] Trovate {len(img_urls)} immagini prodotto (dopo filtri).")
+        if not await self.download_and_upload_images(img_urls, sku, brand):
+            return "request_failed"
+        return "ok"
+
+
+async def run_async_engine(rows, asyncio, aiohttp):
+    """
+    Ritorna True se almeno una riga è finita in errore di rete.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    for row in rows:
+        queue.put_nowait(row)
+
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=ASYNC_MAX_CONCURRENCY)
+
+    with ProcessPoolExecutor(max_workers=ASYNC_PARSE_WORKERS) as parse_executor:
+        async with aiohttp.ClientSession(
+            headers=HEADERS, timeout=timeout, connector=connector
+        ) as session:
+            scraper = AsyncScraper(asyncio, session, loop, parse_executor)
+            failed = []
+
+            async def worker():
+                while True:
+                    try:
+                        sku, brand = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    try:
+                        outcome = await scraper.process_product(sku, brand)
+                        record_outcome(sku, brand, outcome)
+                    except Exception as e:
+                        print(f"   ✖ [{sku}] Errore imprevisto: {e!r}")
+                        outcome = "request_failed"
+                    if outcome == "request_failed":
+                        failed.append(sku)
+
+            n_workers = max(1, min(ASYNC_MAX_CONCURRENCY, len(rows)))
+            print(f"[*] Motore async: {len(rows)} prodotti, {n_workers} worker.")
+            await asyncio.gather(*(worker() for _ in range(n_workers)))
+
+    return bool(failed)
+
+
+def process_products_async(rows):
+    """
+    Ritorna True se almeno una riga è finita in errore di rete, oppure None
+    se aiohttp non è installato: in quel caso il chiamante usa il motore
+    sincrono.
+    """
+    try:
+        import aiohttp
+    except ImportError:
+        print("⚠️ aiohttp non installato: uso il motore sincrono.")
+        return None
+
+    import asyncio
+
+    return asyncio.run(run_async_engine(rows, asyncio, aiohttp))
 
 
 # ========================
 # MAIN
 # ========================
 
-def main():
-    ensure_dir(LOCAL_WORK_DIR)
+def process_start_time():
+    """
+    Istante (epoch) di avvio del processo letto da /proc, così il tempo di
+    avvio include anche l'interprete. None se non disponibile (non Linux).
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # i campi dopo "(comm)" partono dal 3°: starttime è il 22°
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return None
 
-    ftp_download_csv(LOCAL_CSV_PATH)
 
-    with open(LOCAL_CSV_PATH, newline="", encoding="utf-8") as f:
+def startup_time_message():
+    started = process_start_time()
+    if started is None:
+        return f"Avvio (dall'import dello script): {time.time() - _MODULE_T0:.2f}s"
+    return f"Avvio (dall'avvio del processo): {time.time() - started:.2f}s"
+
+
+def read_products_csv(path):
+    """
+    Legge il CSV e ritorna la lista di (sku, brand), oppure None se
+    non trova le colonne SKU/Brand.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
         sample = f.read(2048)
         f.seek(0)
 
@@ -746,22 +1675,80 @@ def main():
 
         if "sku" not in field_map or "brand" not in field_map:
             print("✖ Non riesco a trovare colonne SKU/Brand nel CSV. Controlla intestazioni.")
-            return
+            return None
 
+        rows = []
         for row in reader:
             sku = (row.get(field_map["sku"]) or "").strip()
             brand = (row.get(field_map["brand"]) or "").strip()
             if not sku or not brand:
                 continue
+            rows.append((sku, brand))
 
-            process_product(sku, brand)
-            time.sleep(SLEEP_BETWEEN_REQUESTS)
+    return rows
 
-    global _ftp
-    if _ftp is not None:
-        _ftp.quit()
-        _ftp = None
-        print("[*] Connessione FTP chiusa.")
+
+def process_products_sync(rows):
+    """
+    Ritorna True se almeno una riga è finita in errore di rete.
+    """
+    had_failures = False
+    for sku, brand in rows:
+        outcome = process_product(sku, brand)
+        record_outcome(sku, brand, outcome)
+        if outcome == "request_failed":
+            had_failures = True
+        time.sleep(SLEEP_BETWEEN_REQUESTS)
+    return had_failures
+
+
+def main():
+    global RUN_STARTED_AT
+    RUN_STARTED_AT = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+
+    ensure_dir(LOCAL_WORK_DIR)
+
+    # controllo veloce: se il CSV non è cambiato dall'ultimo run non serve
+    # scaricarlo né importare requests / bs4
+    fingerprint = ftp_csv_fingerprint()
+    if not FORCE_RUN and input_unchanged(fingerprint):
+        print(
+            f"[*] CSV invariato dall'ultimo run (MDTM {fingerprint['mdtm']}, "
+            f"{fingerprint['size']} byte): esco. {startup_time_message()}"
+        )
+        ftp_close()
+        return
+
+    ftp_download_csv(LOCAL_CSV_PATH)
+
+    rows = read_products_csv(LOCAL_CSV_PATH)
+    if rows is None:
+        return
+
+    load_scrape_state()
+    rows, skipped = plan_rows(rows)
+    print(f"[*] Righe da processare: {len(rows)}, saltate da cache: {len(skipped)}")
+    print(f"[*] Avvio completato. {startup_time_message()}")
+
+    print(f"[*] Motore di scraping: {SCRAPER_ENGINE}")
+    had_failures = None
+    if SCRAPER_ENGINE == "async":
+        had_failures = process_products_async(rows)
+    if had_failures is None:
+        had_failures = process_products_sync(rows)
+
+    ftp_publish_manifests()
+    ftp_upload_skip_report(skipped)
+    save_scrape_state()
+
+    # con errori di rete il CSV va rielaborato al prossimo run anche se
+    # non cambia: l'impronta si salva solo dopo un run pulito
+    if had_failures:
+        print("⚠️ Alcune righe sono fallite per errori di rete: il prossimo run le ritenterà.")
+    else:
+        save_input_fingerprint(fingerprint, next_state_expiry())
+
+    ftp_close()
 
 
 if __name__ == "__main__":